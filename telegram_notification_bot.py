@@ -1,9 +1,31 @@
-import os, re, logging, asyncio, yaml, signal
-from dataclasses import dataclass
-from typing import List, Pattern, Dict, Any
-from jinja2 import Template
+import os, logging, asyncio, yaml, signal, threading, warnings
+try:
+    # regex поддерживает timeout: патологический пост не повесит event loop
+    import regex as re
+except ImportError:
+    import re
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+try:
+    from re import _parser as sre_parse  # разбор шаблона стандартным re, Python 3.11+
+except ImportError:
+    import sre_parse
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Pattern, Dict, Any, Optional, Tuple, Set, Callable
+from jinja2 import Environment, Template, nodes
+try:
+    from yaml import CSafeLoader as _YamlLoader  # libyaml
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+import httpx
 from dotenv import load_dotenv
-from telegram import Update
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
 from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
 
 # env из файла для локального запуска; в контейнере переменные придут из compose
@@ -32,17 +54,85 @@ if SOURCE_CHANNEL_ID is None:
     raise SystemExit("SOURCE_CHANNEL_ID обязателен")
 
 RULES_FILE = os.environ.get("RULES_FILE", "/rules.yml")
+REGEX_TIMEOUT = float(os.environ.get("REGEX_TIMEOUT", "1"))
+# concurrent=True отпускает GIL на время поиска — скан идет в потоке (см. _scan)
+_SEARCH_KW: Dict[str, Any] = {"timeout": REGEX_TIMEOUT, "concurrent": True} if re.__name__ == "regex" else {}
 
-@dataclass
+# одно окружение на все шаблоны правил (настройки те же, что у Template(...))
+JINJA_ENV = Environment(autoescape=False)
+
+# шаблон, который просто пересылает исходный текст
+_RAW_ONLY = re.compile(r"\{\{-?\s*_raw\s*-?\}\}\n?")
+
+def _const(text: str) -> Callable[..., str]:
+    return lambda **_: text
+
+def _raw_text(**data: Any) -> str:
+    return data["_raw"]
+
+class _Blank(dict):
+    # неизвестная переменная — пустая строка, как Undefined в Jinja
+    def __missing__(self, key: str) -> str:
+        return ""
+
+def _as_format(source: str) -> Optional[str]:
+    """Переводит шаблон из одних подстановок {{ name }} и текста в строку для str.format_map."""
+    parts: List[str] = []
+    for node in JINJA_ENV.parse(source).body:
+        if not isinstance(node, nodes.Output):
+            return None
+        for child in node.nodes:
+            if isinstance(child, nodes.TemplateData):
+                parts.append(child.data.replace("{", "{{").replace("}", "}}"))
+            elif isinstance(child, nodes.Name):
+                parts.append("{" + child.name + "}")
+            else:
+                return None
+    return "".join(parts)
+
+def _formatter(fmt: str) -> Callable[..., str]:
+    return lambda **data: fmt.format_map(_Blank(data))
+
+@dataclass(frozen=True, slots=True)
 class Rule:
     pattern: Pattern
     topic_id: int
     template: Template
+    render: Callable[..., str]  # template.render или короткий путь без Jinja
+
+def _compile_template(source: str) -> Tuple[Template, Callable[..., str]]:
+    tpl = JINJA_ENV.from_string(source)
+    if not any(tag in source for tag in ("{{", "{%", "{#")):
+        return tpl, _const(tpl.render())  # нет разметки Jinja — текст готов заранее
+    if _RAW_ONLY.fullmatch(source):
+        return tpl, _raw_text
+    fmt = _as_format(source)
+    if fmt is not None:
+        return tpl, _formatter(fmt)
+    return tpl, tpl.render
+
+_RULE_KEYS = ("pattern", "topic_id", "template")
+
+def _check_rule(r: Any) -> Optional[str]:
+    if not isinstance(r, dict):
+        return "rule must be a mapping"
+    missing = [k for k in _RULE_KEYS if r.get(k) is None]
+    if missing:
+        return "missing " + ", ".join(missing)
+    if not isinstance(r["pattern"], str) or not isinstance(r["template"], str):
+        return "pattern and template must be strings"
+    try:
+        int(r["topic_id"])
+    except (TypeError, ValueError):
+        return "topic_id must be an integer"
+    if not isinstance(r.get("ascii", False), bool):
+        return "ascii must be true or false"
+    return None
 
 def load_rules(path: str) -> List[Rule]:
     try:
         with open(path, "r", encoding="utf-8") as f:
-            raw = yaml.safe_load(f) or []
+            raw = yaml.load(f, Loader=_YamlLoader) or []
             if isinstance(raw, dict) and "rules" in raw:
                 raw = raw.get("rules") or []
     except FileNotFoundError:
@@ -57,97 +147,398 @@ def load_rules(path: str) -> List[Rule]:
         log.error("rules root must be a list, got: %s", type(raw).__name__)
         raise SystemExit(1)
 
+    # схема проверяется целиком до компиляции: все ошибки видны сразу
+    errors = [(i, err) for i, r in enumerate(raw) if (err := _check_rule(r))]
+    for i, err in errors:
+        log.error("rule %d missing/invalid keys: %s", i, err)
+    if errors:
+        raise ValueError(f"{len(errors)} invalid rule(s) in {path}")
+
+    # одинаковые шаблоны компилируются один раз; правило с уже встречавшимся
+    # выражением никогда не сработает (выигрывает первое совпадение) и пропускается
+    seen_patterns: Dict[Tuple[str, int], int] = {}
+    templates: Dict[str, Tuple[Template, Callable[..., str]]] = {}
     for i, r in enumerate(raw):
+        pattern_str = r["pattern"]
+        topic_id = int(r["topic_id"])
+        template_str = r["template"]
+        # ascii: true — \w, \d, \b и т.п. только по ASCII, без юникодных таблиц.
+        # Шаблоны остаются str, а не bytes: ASCII-текст CPython и так хранит по байту
+        # на символ (PEP 393), а text.encode() добавил бы лишний проход по посту
+        flags = re.MULTILINE | (re.ASCII if r.get("ascii") else 0)
+        first = seen_patterns.setdefault((pattern_str, flags), i)
+        if first != i:
+            log.warning("rule %d has the same pattern as rule %d and can never match, skipped", i, first)
+            continue
         try:
-            pattern_str = r["pattern"]
-            topic_id = int(r["topic_id"])
-            template_str = r["template"]
-        except Exception as e:
-            log.error("rule %d missing/invalid keys: %s", i, e)
-            raise
-        try:
-            pat = re.compile(pattern_str, re.MULTILINE)
+            pat = re.compile(pattern_str, flags)
         except re.error as e:
             log.error("rule %d regex error: %s", i, e)
             raise
-        tpl = Template(template_str)
-        rules.append(Rule(pat, topic_id, tpl))
+        if template_str not in templates:
+            templates[template_str] = _compile_template(template_str)
+        tpl, render = templates[template_str]
+        rules.append(Rule(pat, topic_id, tpl, render))
         log.info("rule %d -> topic %s", i, topic_id)
 
     if not rules:
         log.warning("rules file is empty: %s", path)
     return rules
 
-RULES = load_rules(RULES_FILE)
+_DIGIT = re.compile(r"\d")
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", sre_parse.MAX_REPEAT))
+
+def _is_digit_only(op, av) -> bool:
+    if op is sre_parse.LITERAL:
+        return _DIGIT.match(chr(av)) is not None
+    if op is sre_parse.CATEGORY:
+        return av is sre_parse.CATEGORY_DIGIT
+    if op is sre_parse.RANGE:
+        return 48 <= av[0] <= av[1] <= 57
+    if op is sre_parse.IN:
+        return bool(av) and all(_is_digit_only(o, a) for o, a in av)
+    return False
+
+# '{' вне повтора {m,n}: stdlib считает его литералом, а regex — нечетким
+# ограничением вроде {e<=1}; \N{...} — имя символа, пропускается
+_REGEX_BRACE = re.compile(r"\\N\{[^}]*\}|\\.|(\{)(?!(?:\d+(?:,\d*)?|,\d+)\})", re.DOTALL)
+
+# POSIX-класс [[:digit:]]: для stdlib это множество и литерал ']'
+_POSIX_CLASS = re.compile(r"\[:\^?\w+:\]")
+
+def _regex_only(src: str) -> bool:
+    """Есть ли в шаблоне синтаксис, который stdlib прочитает иначе, чем модуль regex."""
+    if re.__name__ != "regex":
+        return False
+    return _POSIX_CLASS.search(src) is not None or any(m.group(1) for m in _REGEX_BRACE.finditer(src))
+
+def _analyze_pattern(src: str) -> Tuple[Optional[str], int, bool]:
+    """Инварианты шаблона: самый длинный обязательный литерал (или None),
+    минимальная длина совпадения и обязательна ли в тексте цифра."""
+    if _regex_only(src):
+        # ни литерал, ни min_len, ни needs_digit тогда не верны — префильтр
+        # отсеял бы посты, которые на самом деле совпадают
+        return None, 0, False
+    try:
+        with warnings.catch_warnings():
+            # FutureWarning о вложенных множествах и операциях над ними: здесь
+            # stdlib и regex расходятся, и min_len / цифры тоже были бы неверны
+            warnings.simplefilter("error", FutureWarning)
+            parsed = sre_parse.parse(src, sre_parse.SRE_FLAG_MULTILINE)
+    except Exception:
+        return None, 0, False  # синтаксис только модуля regex
+    ignorecase = bool(parsed.state.flags & sre_parse.SRE_FLAG_IGNORECASE)
+    min_len = parsed.getwidth()[0]
+    best = ""
+    run: List[str] = []
+    needs_digit = False
+
+    def walk(items) -> None:
+        nonlocal best, needs_digit
+        for op, av in items:
+            if _is_digit_only(op, av) or op in _REPEATS and av[0] >= 1 and len(av[2]) == 1 and _is_digit_only(*av[2][0]):
+                needs_digit = True
+            if op is sre_parse.LITERAL and not ignorecase:
+                run.append(chr(av))
+            elif op is sre_parse.SUBPATTERN and not (ignorecase or av[1] & sre_parse.SRE_FLAG_IGNORECASE):
+                walk(av[3])
+            else:
+                if len(run) > len(best):
+                    best = "".join(run)
+                run.clear()
+
+    walk(parsed)
+    if len(run) > len(best):
+        best = "".join(run)
+    return best or None, min_len, needs_digit
+
+class Prefilter:
+    """Отбирает правила, которые вообще могут совпасть с текстом: обязательный литерал
+    ищется одним проходом, плюс дешевые проверки длины и наличия цифр."""
+
+    def __init__(self, patterns: List[str]):
+        literals, self.min_lens, self.needs_digit = zip(*map(_analyze_pattern, patterns)) if patterns else ((), (), ())
+        self.any_digit = any(self.needs_digit)
+        self.always = frozenset(i for i, lit in enumerate(literals) if lit is None)
+        self.by_literal: Dict[str, Tuple[int, ...]] = {}
+        for i, lit in enumerate(literals):
+            if lit is not None:
+                self.by_literal[lit] = self.by_literal.get(lit, ()) + (i,)
+        self.automaton = None
+        if ahocorasick is not None and self.by_literal:
+            self.automaton = ahocorasick.Automaton()
+            for lit, idxs in self.by_literal.items():
+                self.automaton.add_word(lit, idxs)
+            self.automaton.make_automaton()
+
+    def candidates(self, text: str) -> Set[int]:
+        found = set(self.always)
+        if self.automaton is not None:
+            for _, idxs in self.automaton.iter(text):
+                found.update(idxs)
+        else:
+            for lit, idxs in self.by_literal.items():
+                if lit in text:
+                    found.update(idxs)
+        n = len(text)
+        no_digit = self.any_digit and _DIGIT.search(text) is None
+        return {i for i in found if n >= self.min_lens[i] and not (no_digit and self.needs_digit[i])}
+
+@dataclass
+class RuleSet:
+    rules: List[Rule]
+    prefilter: Prefilter
+    # hash(text) -> индекс сработавшего правила или None; новый RuleSet при reload — пустой кеш
+    cache: "OrderedDict[int, Optional[int]]" = field(default_factory=OrderedDict)
+    cache_lock: threading.Lock = field(default_factory=threading.Lock)
+    # параллельные кортежи по индексу правила — горячий путь без обращений к атрибутам Rule
+    searchers: Tuple[Callable[..., Any], ...] = field(init=False)
+    topics: Tuple[int, ...] = field(init=False)
+    renderers: Tuple[Callable[..., str], ...] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.searchers = tuple(r.pattern.search for r in self.rules)
+        self.topics = tuple(r.topic_id for r in self.rules)
+        self.renderers = tuple(r.render for r in self.rules)
+
+def build_ruleset(rules: List[Rule]) -> RuleSet:
+    return RuleSet(rules, Prefilter([r.pattern.pattern for r in rules]))
+
+def _file_key(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+# ключ файла снимается до чтения: правка во время загрузки не будет принята за уже загруженную
+try:
+    _RULES_META = _file_key(RULES_FILE)
+except FileNotFoundError:
+    _RULES_META = (0, 0)  # load_rules ниже сообщит об отсутствии файла
+RULESET = build_ruleset(load_rules(RULES_FILE))
 
 # поддержка горячей перезагрузки правил: kill -HUP <pid>
+# (до старта цикла — через signal.signal, в main() — через loop.add_signal_handler)
 
-def _handle_sighup(signum, frame):
-    global RULES
+def reload_rules() -> None:
+    global RULESET, _RULES_META
     try:
-        RULES = load_rules(RULES_FILE)
-        log.info("rules reloaded: %d", len(RULES))
+        key = _file_key(RULES_FILE)
+        if key == _RULES_META:
+            log.info("rules unchanged, reload skipped")
+            return
+        RULESET = build_ruleset(load_rules(RULES_FILE))
+        _RULES_META = key
+        log.info("rules reloaded: %d", len(RULESET.rules))
     except Exception as e:
         log.exception("rules reload failed: %s", e)
 
-signal.signal(signal.SIGHUP, _handle_sighup)
+if hasattr(signal, "SIGHUP"):
+    # SIGHUP во время старта иначе завершил бы процесс (действие по умолчанию)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_rules())
 
-async def match_and_send(text: str, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not text:
-        return
-    for rule in RULES:
-        m = rule.pattern.search(text)
-        if not m:
-            continue
-        data: Dict[str, Any] = m.groupdict()
-        data["_raw"] = text
-        out_text = rule.template.render(**data)
+MATCH_CACHE_SIZE = 4096
+
+# неизменяемая конфигурация захватывается значениями по умолчанию (LOAD_FAST вместо
+# LOAD_GLOBAL); RULESET так не захватывается — он меняется при перезагрузке правил
+
+def _search(rs: RuleSet, text: str, _kw: Dict[str, Any] = _SEARCH_KW) -> Optional[Tuple[int, Dict[str, Any]]]:
+    candidates = rs.prefilter.candidates(text)
+    if not candidates:
+        return None
+    searchers = rs.searchers
+    for idx in sorted(candidates):
+        m = searchers[idx](text, **_kw)
+        if m:
+            return idx, m.groupdict()  # одно совпадение на сообщение
+    return None
+
+def _scan(rs: RuleSet, text: str, _kw: Dict[str, Any] = _SEARCH_KW) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """Ищет первое сработавшее правило; без обращений к event loop, вызывается в потоке."""
+    key = hash(text)
+    with rs.cache_lock:
+        hit = key in rs.cache
+        if hit:
+            cached = rs.cache[key]
+            rs.cache.move_to_end(key)
+    if hit and cached is None:
+        return None
+    try:
+        found = None
+        if hit:
+            # повтор текста (пересылка, правка): проверяем только известное правило
+            m = rs.searchers[cached](text, **_kw)
+            if m:
+                found = cached, m.groupdict()
+        if found is None:
+            found = _search(rs, text)
+    except TimeoutError:
+        log.warning("regex timeout, text_len=%s", len(text))
+        return None
+    with rs.cache_lock:
+        rs.cache[key] = found[0] if found else None
+        if len(rs.cache) > MATCH_CACHE_SIZE:
+            rs.cache.popitem(last=False)
+    if found is None:
+        return None
+    idx, data = found
+    data["_raw"] = text
+    return idx, data
+
+# исходящие сообщения: очередь и фоновый воркер на каждый топик, соседние
+# сообщения в один топик склеиваются в одну отправку
+
+SEND_WINDOW = 0.2
+# ошибки httpx до отправки запроса (в PTB приходят как __cause__ у NetworkError/TimedOut)
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+SEND_RETRIES = 3
+MAX_MESSAGE_LEN = 4096
+BATCH_SEPARATOR = "\n\n---\n\n"
+OUTBOX: Dict[int, "asyncio.Queue[str]"] = {}
+_OUTBOX_WORKERS: Dict[int, "asyncio.Task[None]"] = {}
+_IN_FLIGHT: Dict[int, int] = {}  # топик -> размер пачки, которую воркер сейчас отправляет
+
+def _enqueue(bot: Bot, topic_id: int, text: str) -> None:
+    queue = OUTBOX.get(topic_id)
+    if queue is None:
+        queue = OUTBOX[topic_id] = asyncio.Queue()
+        _OUTBOX_WORKERS[topic_id] = asyncio.create_task(_topic_worker(bot, topic_id, queue))
+    queue.put_nowait(text)
+
+def _coalesce(texts: List[str]) -> List[str]:
+    out: List[str] = []
+    for text in texts:
+        if out and len(out[-1]) + len(BATCH_SEPARATOR) + len(text) <= MAX_MESSAGE_LEN:
+            out[-1] += BATCH_SEPARATOR + text
+        else:
+            out.append(text)
+    return out
+
+async def _send(bot: Bot, topic_id: int, text: str, _superchat: int = SUPERCHAT_ID) -> None:
+    delay = 1.0
+    for attempt in range(1, SEND_RETRIES + 1):
         try:
-            await asyncio.wait_for(
-                context.bot.send_message(
-                    chat_id=SUPERCHAT_ID,
-                    text=out_text,
-                    message_thread_id=rule.topic_id,
-                    parse_mode=None,
-                    disable_web_page_preview=True,
-                ),
-                timeout=5,
+            # без внешнего wait_for: таймауты PTB (connect/write/read) сообщают через
+            # __cause__, на каком этапе оборвался запрос
+            await bot.send_message(
+                chat_id=_superchat,
+                text=text,
+                message_thread_id=topic_id,
+                parse_mode=None,
+                disable_web_page_preview=True,
             )
-            log.info("sent -> topic %s", rule.topic_id)
-        except asyncio.TimeoutError:
-            log.error("send timeout -> topic %s", rule.topic_id)
+            log.info("sent -> topic %s", topic_id)
+            return
+        except RetryAfter as e:
+            log.warning("rate limited -> topic %s, retry in %ss", topic_id, e.retry_after)
+            delay = max(delay, float(e.retry_after))
+        except NetworkError as e:
+            # повторяем, только если запрос точно не ушел: не удалось соединиться;
+            # иначе запрос мог дойти до Telegram — повтор дал бы дубль
+            if not isinstance(e.__cause__, _NOT_SENT_ERRORS):
+                if isinstance(e, TimedOut):
+                    log.error("send timeout -> topic %s", topic_id)
+                else:
+                    log.exception("send failed: %s", e)
+                return
+            log.error("send failed -> topic %s (attempt %d): %s", topic_id, attempt, e)
         except Exception as e:
             log.exception("send failed: %s", e)
-        break  # одно совпадение на сообщение
+            return
+        if attempt < SEND_RETRIES:
+            await asyncio.sleep(delay)
+            delay *= 2
+    log.error("send gave up -> topic %s", topic_id)
+
+async def _topic_worker(bot: Bot, topic_id: int, queue: "asyncio.Queue[str]") -> None:
+    while True:
+        batch = [await queue.get()]
+        await asyncio.sleep(SEND_WINDOW)  # ждем соседние сообщения
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        _IN_FLIGHT[topic_id] = len(batch)
+        try:
+            for text in _coalesce(batch):
+                await _send(bot, topic_id, text)
+        finally:
+            _IN_FLIGHT[topic_id] = 0
+            for _ in batch:
+                queue.task_done()
+
+async def _drain_outbox(timeout: float = 5) -> None:
+    # docker stop ждет 10 с до SIGKILL — досылаем очередь, но укладываемся раньше
+    try:
+        await asyncio.wait_for(asyncio.gather(*(q.join() for q in OUTBOX.values())), timeout=timeout)
+    except asyncio.TimeoutError:
+        # в очередях и в пачках, которые воркеры уже взяли, но не досылали
+        dropped = sum(q.qsize() for q in OUTBOX.values()) + sum(_IN_FLIGHT.values())
+        log.warning("outbox drain timeout, dropped up to %d message(s)", dropped)
+    for task in _OUTBOX_WORKERS.values():
+        task.cancel()
+    # воркеры должны завершиться до того, как app.shutdown() закроет HTTP-клиент
+    await asyncio.gather(*_OUTBOX_WORKERS.values(), return_exceptions=True)
+
+async def match_and_send(text: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not text:
+        return
+    rs = RULESET
+    found = await asyncio.to_thread(_scan, rs, text)
+    if found is None:
+        return
+    idx, data = found
+    out_text = rs.renderers[idx](**data)
+    _enqueue(context.bot, rs.topics[idx], out_text)
 
-async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def handle_channel_post(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, _source: Optional[int] = SOURCE_CHANNEL_ID
+) -> None:
     msg = update.channel_post
     if not msg:
         return
-    log.info("channel_post chat=%s text_len=%s caption_len=%s", msg.chat_id, len(msg.text or ""), len(msg.caption or ""))
+    text = msg.text or msg.caption or ""
+    if log.isEnabledFor(logging.INFO):
+        log.info("channel_post chat=%s text_len=%s", msg.chat_id, len(text))
     # если указан SOURCE_CHANNEL_ID — фильтруем по нему; если нет — принимаем все посты каналов
-    if SOURCE_CHANNEL_ID is not None and msg.chat_id != SOURCE_CHANNEL_ID:
+    if _source is not None and msg.chat_id != _source:
         return
-    text = msg.text or msg.caption or ""
     await match_and_send(text, context)
 
 async def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    # отправки мультиплексируются по HTTP/2 в пуле постоянных соединений;
+    # long polling getUpdates остается на своем соединении по умолчанию
+    send_request = HTTPXRequest(http_version="2", connection_pool_size=32, pool_timeout=1.0)
+    app = ApplicationBuilder().token(BOT_TOKEN).request(send_request).build()
     # посты из каналов только
     app.add_handler(MessageHandler(filters.ChatType.CHANNEL, handle_channel_post))
     log.info(
         "started. source_channel=%s target_superchat=%s",
         SOURCE_CHANNEL_ID, SUPERCHAT_ID,
     )
+    loop = asyncio.get_running_loop()
+    # ограниченный пул для asyncio.to_thread(_scan, ...)
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=os.cpu_count() or 1))
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, reload_rules)
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows: остановка через KeyboardInterrupt, как раньше
+            pass
     await app.initialize()
     await app.start()
     try:
         await app.updater.start_polling(allowed_updates=["channel_post"], drop_pending_updates=True)
-        await asyncio.Event().wait()
+        await stop.wait()
+        log.info("stopping")
     finally:
         await app.updater.stop()
         await app.stop()
+        await _drain_outbox()
         await app.shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        import uvloop
+    except ImportError:  # нет сборки под платформу (Windows)
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
\ No newline at end of file
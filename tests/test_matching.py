@@ -0,0 +1,118 @@
+"""Дифференциальные проверки: префильтр + _search против простого цикла по правилам,
+быстрый рендер шаблонов против Jinja. Тексты случайные, но с фиксированным seed."""
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+import yaml
+
+_EMPTY_RULES = tempfile.NamedTemporaryFile("w", suffix=".yml", delete=False)
+_EMPTY_RULES.write("[]\n")
+_EMPTY_RULES.close()
+os.environ.update(BOT_TOKEN="0:test", SUPERCHAT_ID="1", SOURCE_CHANNEL_ID="2", RULES_FILE=_EMPTY_RULES.name)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import telegram_notification_bot as bot  # noqa: E402
+
+PATTERNS = [
+    r"error \d+",
+    r"(?i)warn(?P<n>\d)",
+    r"code [0-9]{2,}",
+    r"^#login_attempt_(?P<status>ok|fail)$",
+    r"a.b",
+    r"(?x) foo \s+ bar  # комментарий",
+    r"(?P<user>\w+)@(?P<host>\w+)\.ru",
+    r"x[^0-9]y",
+    r"\bid:\s*(?P<id>\d+)",
+    r"(?ms)^.*?#login_attempt_(?P<s>\w+).*?\n.*?id:\s*(?P<id>\d+)",
+    # синтаксис, который stdlib-парсер префильтра читает иначе, чем модуль regex
+    r"(?:error){e<=1}",
+    r"(?:abc){i<=1}d",
+    r"code [[:digit:]]",
+    r"x[[:alpha:]]\d+",
+    r"v[a-z--q]1",
+    r"(?V1)[[a-z]--[b]]ar",
+    r"\p{Lu}{2}\d",
+]
+
+FRAGMENTS = [
+    "error", "erorr", "eror", " ", "  ", "1", "42", "7", "code", "[", "]", ":", "warn", "WARN",
+    "#login_attempt_", "ok", "fail", "\n", "foo", "bar", "user", "@", "mail", ".ru", "x", "y",
+    "id:", "abxcd", "abc", "d", "vq1", "vr1", "xar", "bar", "AB", "Ж", "Ёж", "a", "b", "-",
+]
+
+TEMPLATES = [
+    "{{ x }}",
+    "hi {{ x }}!",
+    "a {{ x }} {b} }} {{y}}\n",
+    "{{ x }}{{ missing }}\n\n",
+    "{# c #}{{ x }} / {{ y }}",
+    "{{- x -}} {{ y }}",
+    "{{ x|upper }}",
+    "{% if x %}{{ x }}{% endif %}",
+    "{{ '{' }}{{ x }}",
+]
+
+def _plain(rules, text):
+    for i, rule in enumerate(rules):
+        m = rule.pattern.search(text)
+        if m:
+            return i, m.groupdict()
+    return None
+
+def _load(tmp_path, patterns):
+    path = tmp_path / "rules.yml"
+    path.write_text(
+        yaml.safe_dump([{"pattern": p, "topic_id": i, "template": "{{ _raw }}"} for i, p in enumerate(patterns)]),
+        encoding="utf-8",
+    )
+    return bot.load_rules(str(path))
+
+def _compiles(pattern):
+    try:
+        bot.re.compile(pattern)
+    except bot.re.error:
+        return False  # синтаксис только regex, а установлен stdlib re
+    return True
+
+@pytest.mark.parametrize("seed", range(8))
+def test_search_matches_plain_loop(tmp_path, seed):
+    rnd = random.Random(seed)
+    patterns = [p for p in PATTERNS if _compiles(p)]
+    rnd.shuffle(patterns)
+    rules = _load(tmp_path, patterns[:rnd.randint(1, len(patterns))])
+    rs = bot.build_ruleset(rules)
+    for _ in range(1500):
+        text = "".join(rnd.choices(FRAGMENTS, k=rnd.randint(0, 12)))
+        want = _plain(rules, text)
+        assert bot._search(rs, text) == want, (text, [r.pattern.pattern for r in rules])
+        # второй вызов идет через кеш совпадений
+        for _ in range(2):
+            got = bot._scan(rs, text)
+            assert (got and (got[0], {k: v for k, v in got[1].items() if k != "_raw"})) == want, text
+
+@pytest.mark.parametrize("pattern", [p for p in PATTERNS if _compiles(p)])
+def test_each_pattern_alone(tmp_path, pattern):
+    rules = _load(tmp_path, [pattern])
+    rs = bot.build_ruleset(rules)
+    rnd = random.Random(pattern)
+    for _ in range(500):
+        text = "".join(rnd.choices(FRAGMENTS, k=rnd.randint(0, 10)))
+        assert bot._search(rs, text) == _plain(rules, text), text
+
+def test_format_templates_render_like_jinja():
+    rnd = random.Random(0)
+    values = ["X", "", None, 0, 42, "{b}", "}}", "Ж ё", "a\nb"]
+    fast = [t for t in TEMPLATES if bot._as_format(t) is not None]
+    assert len(fast) >= 5  # иначе проверка ничего не проверяет
+    for template in TEMPLATES:
+        fmt = bot._as_format(template)
+        if fmt is None:
+            continue
+        jinja = bot.JINJA_ENV.from_string(template)
+        for _ in range(50):
+            data = {k: rnd.choice(values) for k in ("x", "y") if rnd.random() < 0.8}
+            assert bot._formatter(fmt)(**data) == jinja.render(**data), (template, data)